@@ -1,5 +1,237 @@
+import os
+import sys
+import warnings
+
 import numpy as np
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Probabilities are floored at this value before taking logs, so that beam
+# scores stay finite
+MIN_PROB = 1e-30
+
+# Beam search log scores are single precision: logs of probabilities have a
+# modest range, and half the bytes per score halves the memory traffic of
+# every beam step
+SCORE_DTYPE = np.float32
+
+# Path ids and extension keys are 64-bit on every platform, as the Cython beam
+# step requires, rather than the platform's default int
+PATH_DTYPE = np.int64
+
+# Fast-math flags for the compiled beam step; "nnan" and "ninf" are left out
+# because log scores of zero probabilities are -inf
+FASTMATH_FLAGS = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+
+def jit(func):
+    """
+    Compile 'func' with Numba when it is installed, otherwise return it as is.
+    """
+    if numba is None:
+        return func
+    return numba.njit(cache=True, fastmath=FASTMATH_FLAGS)(func)
+
+
+@jit
+def log_add(a, b):
+    """
+    Return log(exp(a) + exp(b)) for scalar log scores.
+    """
+    if a < b:
+        a, b = b, a
+    if b == -np.inf:
+        return a
+    return a + np.log1p(np.exp(b - a))
+
+
+@jit
+def merge_sorted(keys, scores):
+    """
+    Combine the log scores of repeated keys, returning the sorted unique keys
+    and their merged scores. The sort is stable, so repeated keys are merged
+    in input order as merge_scores does, and rounding agrees with it.
+    """
+    order = np.argsort(keys, kind="mergesort")
+    merged_keys = np.empty(len(keys), dtype=keys.dtype)
+    merged_scores = np.empty(len(keys), dtype=scores.dtype)
+    n = 0
+    for i in order:
+        if n > 0 and merged_keys[n - 1] == keys[i]:
+            merged_scores[n - 1] = log_add(merged_scores[n - 1], scores[i])
+        else:
+            merged_keys[n] = keys[i]
+            merged_scores[n] = scores[i]
+            n += 1
+    return merged_keys[:n], merged_scores[:n]
+
+
+@jit
+def push_bounded(heap, size, score):
+    """
+    Push 'score' into the min-heap 'heap' holding 'size' scores, replacing its
+    minimum once it is full. Returns the new size.
+    """
+    if size < len(heap):
+        i = size
+        heap[i] = score
+        while i > 0 and heap[(i - 1) // 2] > heap[i]:
+            parent = (i - 1) // 2
+            heap[i], heap[parent] = heap[parent], heap[i]
+            i = parent
+        return size + 1
+
+    if score > heap[0]:
+        heap[0] = score
+        i = 0
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and heap[child] < heap[smallest]:
+                    smallest = child
+            if smallest == i:
+                break
+            heap[i], heap[smallest] = heap[smallest], heap[i]
+            i = smallest
+    return size
+
+
+@jit
+def select_beam(blank_paths, symbol_keys, blank_scores, symbol_scores, cutoff):
+    """
+    Return the path, score and is_blank arrays of a beam holding the merged
+    candidates that score at least 'cutoff', blank-terminal paths first.
+    """
+    size = len(blank_paths) + len(symbol_keys)
+    paths = np.empty(size, dtype=blank_paths.dtype)
+    scores = np.empty(size, dtype=blank_scores.dtype)
+    is_blank = np.empty(size, dtype=np.bool_)
+    n = 0
+    for i in range(len(blank_paths)):
+        if blank_scores[i] >= cutoff:
+            paths[n] = blank_paths[i]
+            scores[n] = blank_scores[i]
+            is_blank[n] = True
+            n += 1
+    for i in range(len(symbol_keys)):
+        if symbol_scores[i] >= cutoff:
+            paths[n] = symbol_keys[i]
+            scores[n] = symbol_scores[i]
+            is_blank[n] = False
+            n += 1
+    return paths[:n], scores[:n], is_blank[:n]
+
+
+@jit
+def beam_step_kernel(
+    paths,
+    scores,
+    is_blank,
+    parents,
+    last_sym,
+    log_probs,
+    num_symbols,
+    beam_width,
+    alpha,
+    prune,
+    candidate_keys,
+    candidate_scores,
+):
+    """
+    Compiled counterpart of BeamSearchDecoder.beam_step, up to assigning ids to
+    the extended paths. Takes the arrays of a BeamState and the path table, and
+    writes candidates into the 'candidate_keys' and 'candidate_scores' buffers.
+    Returns the arrays of the new BeamState, whose symbol-terminal paths are
+    still extension keys.
+    """
+    num_paths = len(paths)
+
+    # Extending by a blank
+    keys = candidate_keys[:num_paths]
+    new_scores = candidate_scores[:num_paths]
+    for i in range(num_paths):
+        keys[i] = paths[i]
+        new_scores[i] = scores[i] + log_probs[0]
+    new_blank_paths, new_blank_scores = merge_sorted(keys, new_scores)
+
+    # Extending by a symbol; repeating the last symbol of a symbol-terminal path
+    # keeps the path's key, so that one entry per such path is overwritten
+    # after the symbol loop
+    num_extend = num_symbols - 1
+    keys = candidate_keys[: num_paths * num_extend]
+    new_scores = candidate_scores[: len(keys)]
+    n = 0
+    for i in range(num_paths):
+        for c in range(1, num_symbols):
+            keys[n] = paths[i] * num_symbols + c
+            new_scores[n] = scores[i] + log_probs[c]
+            n += 1
+        if not is_blank[i]:
+            path = paths[i]
+            repeat = n - num_extend + last_sym[path] - 1
+            keys[repeat] = parents[path] * num_symbols + last_sym[path]
+    new_symbol_keys, new_symbol_scores = merge_sorted(keys, new_scores)
+
+    if not prune:
+        return select_beam(
+            new_blank_paths,
+            new_symbol_keys,
+            new_blank_scores,
+            new_symbol_scores,
+            -np.inf,
+        )
+
+    # Scores below the alpha threshold are dropped before the top-k search. It
+    # is computed in double precision and capped at the best score, so that
+    # rounding can never leave the heap empty
+    threshold = -np.inf
+    if alpha > 0:
+        best = np.float64(max(new_blank_scores.max(), new_symbol_scores.max()))
+        worst = np.float64(min(new_blank_scores.min(), new_symbol_scores.min()))
+        threshold = min(alpha * best + (1 - alpha) * worst, best)
+
+    # Cutoff score retaining exactly beam_width paths from a bounded min-heap
+    heap = np.empty(beam_width, dtype=scores.dtype)
+    size = 0
+    for score in new_blank_scores:
+        if score >= threshold:
+            size = push_bounded(heap, size, score)
+    for score in new_symbol_scores:
+        if score >= threshold:
+            size = push_bounded(heap, size, score)
+    cutoff = max(heap[0], threshold)
+
+    return select_beam(
+        new_blank_paths, new_symbol_keys, new_blank_scores, new_symbol_scores, cutoff
+    )
+
+
+# The Cython build of the beam step is only used once it has been compiled
+# next to this file ("cythonize -i CTC/beam_step.pyx"); nothing is built on
+# import. Its directory is put on the path for the import whether this module
+# is imported as CTCDecoding or as CTC.CTCDecoding.
+CTC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, CTC_DIR)
+try:
+    from beam_step import beam_step_kernel as cython_beam_step
+except ModuleNotFoundError:
+    cython_beam_step = None
+except ImportError as error:
+    warnings.warn("Cannot load the built Cython beam step: %s" % error)
+    cython_beam_step = None
+finally:
+    sys.path.remove(CTC_DIR)
+
+# Prefer the Numba beam step, then the Cython build; without either
+# BeamSearchDecoder runs the step with NumPy
+if numba is not None:
+    compiled_beam_step = beam_step_kernel
+else:
+    compiled_beam_step = cython_beam_step
+
 
 class GreedySearchDecoder(object):
     def __init__(self, symbol_set):
@@ -36,7 +268,11 @@ class GreedySearchDecoder(object):
             compressed symbol sequence i.e. without blanks or repeated symbols
 
         path_prob [float]:
-            forward probability of the greedy path
+            forward probability of the greedy path; its log is kept in
+            self.log_prob since the product underflows for long sequences
+
+        For batch_size > 1, decoded_path, path_prob and self.log_prob are
+        lists with one entry per sequence in the batch.
 
         """
 
@@ -51,29 +287,82 @@ class GreedySearchDecoder(object):
         # 4. Select most probable symbol and append to decoded_path
         # 5. Compress sequence (Inside or outside the loop)
 
-        path_prob = 1.0
-        uncompressed_path = []
-        for t in range(y_probs.shape[1]):
-            max_prob = -1
-            max_idx = -1
-            for s in range(y_probs.shape[0]):
-                if y_probs[s, t, 0] > max_prob:
-                    max_prob = y_probs[s, t, 0]
-                    max_idx = s
-            path_prob *= max_prob
-            if max_idx != 0:  # Skip the blanks
-                uncompressed_path.append(self.symbol_set[max_idx - 1])
-
-        # Compress the path by removing blanks and repeated symbols
-        for i in range(len(uncompressed_path)):
-            if i == 0 or uncompressed_path[i] != uncompressed_path[i - 1]:
-                decoded_path += uncompressed_path[i]
+        # Most probable symbol (and its probability) at every timestep of every
+        # sequence in the batch. The symbol axis is moved innermost and made
+        # contiguous first, so that the argmax runs over unit-stride rows.
+        T = y_probs.shape[1]
+        probs = np.ascontiguousarray(np.moveaxis(y_probs, 0, -1))
+        max_idx = probs.argmax(axis=-1)
+        max_probs = np.take_along_axis(probs, max_idx[..., None], axis=-1)[..., 0]
+
+        # The path probability is the product of the maxima in timestep order,
+        # as multiplying step by step gives; the log is only kept alongside it
+        path_probs = np.prod(max_probs, axis=0).tolist()
+        log_probs = np.log(max_probs).sum(axis=0)
+
+        # Compress the paths by removing blanks and repeated symbols: a symbol is
+        # kept unless it repeats the last non-blank symbol before it
+        steps = np.arange(T)[:, None]
+        last_symbol_step = np.maximum.accumulate(
+            np.where(max_idx != blank, steps, -1), axis=0
+        )
+        previous_symbol = np.where(
+            last_symbol_step >= 0,
+            np.take_along_axis(max_idx, np.maximum(last_symbol_step, 0), axis=0),
+            blank,
+        )
+        keep = max_idx != blank
+        keep[1:] &= max_idx[1:] != previous_symbol[:-1]
+
+        decoded_paths = [
+            "".join(self.symbol_set[i - 1] for i in max_idx[keep[:, b], b])
+            for b in range(y_probs.shape[2])
+        ]
+
+        if len(decoded_paths) > 1:
+            self.log_prob = log_probs.tolist()
+            return decoded_paths, path_probs
+
+        self.log_prob = float(log_probs[0])
+        decoded_path, path_prob = decoded_paths[0], path_probs[0]
 
         return decoded_path, path_prob
 
 
+class BeamState(object):
+    def __init__(self, paths, scores, is_blank):
+        """
+        Hypotheses of a beam as aligned arrays, one entry per path: the path id
+        (or extension key, before it is given an id), its log score, and
+        whether it ends in a blank. Parents and last symbols are not copied
+        here; they are looked up by path id in the decoder's path table.
+        """
+        self.paths = paths
+        self.scores = scores
+        self.is_blank = is_blank
+
+    @classmethod
+    def join(cls, blank_paths, symbol_paths, blank_scores, symbol_scores):
+        """
+        Build a beam from its blank-terminal and symbol-terminal paths.
+        """
+        is_blank = np.zeros(len(blank_paths) + len(symbol_paths), dtype=bool)
+        is_blank[: len(blank_paths)] = True
+        return cls(
+            np.concatenate((blank_paths, symbol_paths)),
+            np.concatenate((blank_scores, symbol_scores)),
+            is_blank,
+        )
+
+    def select(self, mask):
+        """
+        Return the beam of the hypotheses where 'mask' is True.
+        """
+        return BeamState(self.paths[mask], self.scores[mask], self.is_blank[mask])
+
+
 class BeamSearchDecoder(object):
-    def __init__(self, symbol_set, beam_width):
+    def __init__(self, symbol_set, beam_width, alpha=None):
         """
 
         Initialize instance variables
@@ -87,10 +376,28 @@ class BeamSearchDecoder(object):
         beam_width [int]:
             beam width for selecting top-k hypotheses for expansion
 
+        alpha [float, optional]:
+            if given (0 <= alpha <= 1), hypotheses scoring below
+            alpha * best + (1 - alpha) * worst log score are pruned before the
+            top 'beam_width' are selected; None keeps the plain top-k pruning
+
         """
 
+        if alpha is not None and not 0 <= alpha <= 1:
+            raise ValueError("alpha must be between 0 and 1, got %r" % (alpha,))
+
         self.symbol_set = symbol_set
         self.beam_width = beam_width
+        self.alpha = alpha
+
+        # Working buffers for the candidates of a beam step, reused across
+        # timesteps; ties at the prune cutoff can make them grow
+        self.candidate_keys = np.empty(
+            beam_width * (len(symbol_set) + 1), dtype=PATH_DTYPE
+        )
+        self.candidate_scores = np.empty(
+            beam_width * (len(symbol_set) + 1), dtype=SCORE_DTYPE
+        )
 
     def decode(self, y_probs):
         """
@@ -113,9 +420,46 @@ class BeamSearchDecoder(object):
         merged_path_scores [dict]:
             all the final merged paths with their scores
 
+        For batch_size > 1, forward_path and merged_path_scores are lists with
+        one entry per sequence in the batch.
+
         """
 
-        T = y_probs.shape[1]
+        # Path scores are accumulated as log probabilities so that products over
+        # long sequences do not underflow; they are exponentiated only on return.
+        # The log is taken once for the whole batch.
+        # It is laid out as (batch_size, seq_length, len(symbols) + 1), so that
+        # each timestep is a contiguous row that the beam steps take as a view.
+        log_probs = np.ascontiguousarray(
+            np.maximum(y_probs, MIN_PROB).transpose(2, 1, 0), dtype=SCORE_DTYPE
+        )
+        np.log(log_probs, out=log_probs)
+
+        # Each sequence in the batch keeps its own beam of hypotheses
+        results = [self.decode_sequence(log_probs[b]) for b in range(y_probs.shape[2])]
+        if len(results) > 1:
+            best_paths, merged_path_scores = zip(*results)
+            return list(best_paths), list(merged_path_scores)
+        return results[0]
+
+    def decode_sequence(self, log_probs):
+        """
+        Perform beam search decoding of a single sequence
+
+        Input
+        -----
+
+        log_probs [np.array, dim=(seq_length, len(symbols) + 1)]
+            log of the symbol probabilities y_probs of the sequence
+
+        Returns
+        -------
+
+        forward_path [str], merged_path_scores [dict]: as returned by decode
+
+        """
+
+        T = log_probs.shape[0]
         bestPath, FinalPathScore = None, None
 
         # TODO:
@@ -127,221 +471,266 @@ class BeamSearchDecoder(object):
         # 5. After iterating through all time steps, selecting the best path
         #    and its score.
 
-        self.blank_path_score = {}
-        self.path_score = {}
-
-        (
-            new_paths_with_terminal_blank,
-            new_paths_with_terminal_symbol,
-            new_blank_path_score,
-            new_path_score,
-        ) = self.initialize_paths(y_probs)
-
+        # Paths are integer ids into a table of (parent id, last symbol) back
+        # pointers, so extending a path never copies it; id 0 is the empty path.
+        # Candidate extensions are identified by their key
+        # parent id * num_symbols + symbol and only get an id once they survive
+        # pruning, so the table grows by at most a beam per timestep. 'children'
+        # maps the key of every path id handed out back to that id. The table is
+        # filled in by initialize_paths.
+        self.num_symbols = len(self.symbol_set) + 1
+
+        # The beam is a BeamState of path ids aligned with their log scores
+        beam = self.initialize_paths(log_probs)
+
+        # Each step extends the pruned beam and prunes the result in one pass.
+        # The candidates of the last step are merged without pruning.
+        if T > 1:
+            beam = self.prune(beam)
         for t in range(1, T):
-            (
-                paths_with_terminal_blank,
-                paths_with_terminal_symbol,
-                self.blank_path_score,
-                self.path_score,
-            ) = self.prune(
-                new_paths_with_terminal_blank,
-                new_paths_with_terminal_symbol,
-                new_blank_path_score,
-                new_path_score,
-            )
+            beam = self.beam_step(beam, log_probs[t], prune=t < T - 1)
 
-            # First extend paths by a blank
-            (
-                new_paths_with_terminal_blank,
-                new_blank_path_score,
-            ) = self.extend_with_blank(
-                paths_with_terminal_blank,
-                paths_with_terminal_symbol,
-                y_probs[:, t, 0],
-            )
-
-            # Next extend paths by a symbol
-            new_paths_with_terminal_symbol, new_path_score = self.extend_with_symbol(
-                paths_with_terminal_blank, paths_with_terminal_symbol, y_probs[:, t, 0]
-            )
-
-        merged_paths, merged_path_scores = self.merge_identical_paths(
-            new_paths_with_terminal_blank,
-            new_blank_path_score,
-            new_paths_with_terminal_symbol,
-            new_path_score,
-        )
+        merged_paths, merged_path_scores = self.merge_identical_paths(beam)
 
+        # The best path is chosen on log scores, since the probabilities of long
+        # sequences can underflow; they are returned in double precision
         bestPath = None
-        FinalPathScore = -1
+        FinalPathScore = -np.inf
         for path in merged_paths:
             if merged_path_scores[path] > FinalPathScore:
                 FinalPathScore = merged_path_scores[path]
                 bestPath = path
 
+        merged_path_scores = {
+            path: np.exp(np.float64(score))
+            for path, score in merged_path_scores.items()
+        }
+
         return bestPath, merged_path_scores
 
-    def initialize_paths(self, y_probs):
+    def path_keys(self, paths):
+        """
+        Return the (parent id, last symbol) keys of path ids 'paths'.
+        """
+        return self.parents[paths] * self.num_symbols + self.last_sym[paths]
+
+    def add_paths(self, keys):
+        """
+        Return the path ids for extension keys 'keys', appending back pointers
+        for the keys that have not been seen before.
+        """
+        new_paths = []
+        new_keys = []
+        for key in keys.tolist():
+            # A single lookup both finds known keys and claims ids for new ones
+            next_id = self.num_paths + len(new_keys)
+            path = self.children.setdefault(key, next_id)
+            if path == next_id:
+                new_keys.append(key)
+            new_paths.append(path)
+
+        new_ids = np.arange(self.num_paths, self.num_paths + len(new_keys))
+        self.num_paths += len(new_keys)
+        if self.num_paths > len(self.parents):
+            grow = max(len(self.parents), self.num_paths - len(self.parents))
+            self.parents = np.concatenate(
+                (self.parents, np.full(grow, -1, dtype=PATH_DTYPE))
+            )
+            self.last_sym = np.concatenate(
+                (self.last_sym, np.zeros(grow, dtype=PATH_DTYPE))
+            )
+        self.parents[new_ids], self.last_sym[new_ids] = np.divmod(
+            np.array(new_keys, dtype=PATH_DTYPE), self.num_symbols
+        )
+        return np.array(new_paths, dtype=PATH_DTYPE)
+
+    def path_to_string(self, path, parents, last_sym):
+        """
+        Reconstruct the symbol sequence of path id 'path' from parent pointers;
+        'parents' and 'last_sym' are the path table as lists.
+        """
+        symbols = []
+        while path > 0:
+            symbols.append(self.symbol_set[last_sym[path] - 1])
+            path = parents[path]
+        return "".join(reversed(symbols))
+
+    def candidate_buffers(self, beam_size):
+        """
+        Return views of the candidate key and score buffers holding one entry
+        per (path, symbol) extension of a beam of 'beam_size' paths.
+        """
+        size = beam_size * (self.num_symbols - 1)
+        if size > len(self.candidate_keys):
+            self.candidate_keys = np.empty(size, dtype=PATH_DTYPE)
+            self.candidate_scores = np.empty(size, dtype=SCORE_DTYPE)
+        return self.candidate_keys[:size], self.candidate_scores[:size]
+
+    def merge_scores(self, paths, scores):
+        """
+        Combine the log scores of repeated path ids (or keys), returning the
+        unique ids and their merged scores.
+        """
+        unique_paths, inverse = np.unique(paths, return_inverse=True)
+        merged_scores = np.full(len(unique_paths), -np.inf, dtype=scores.dtype)
+        np.logaddexp.at(merged_scores, inverse.ravel(), scores)
+        return unique_paths, merged_scores
+
+    def initialize_paths(self, log_probs):
         """
         Input
         -----
 
-        y_probs [np.array, dim=(len(symbols) + 1, seq_length, batch_size)]
-                        batch size for part 1 will remain 1, but if you plan to use your
-                        implementation for part 2 you need to incorporate batch_size
+        log_probs [np.array, dim=(seq_length, len(symbols) + 1)]
         """
-        initial_blank_path_score = {}
-        initial_path_score = {}
-
         # First push the blank into a path-ending-with-blank stack. No symbol has been invoked yet
-        path = ""
-        initial_blank_path_score[path] = y_probs[0, 0, 0]  # blank prob at t=0
-        initial_paths_with_final_blank = {""}
-
-        # Push rest of the symbols into a path-ending-with-symbol stack
-        initial_paths_with_final_symbols = set()
-        for i, c in enumerate(self.symbol_set):
-            path = c
-            initial_path_score[path] = y_probs[i + 1, 0, 0]  # symbol prob at t=0
-            initial_paths_with_final_symbols.add(path)
-
-        return (
+        initial_paths_with_final_blank = np.zeros(1, dtype=PATH_DTYPE)
+        initial_blank_path_score = log_probs[0, :1]  # blank prob at t=0
+
+        # Push rest of the symbols into a path-ending-with-symbol stack. Symbol s
+        # on its own is path id s, whose key (parent 0, symbol s) is also s.
+        initial_paths_with_final_symbols = np.arange(
+            1, self.num_symbols, dtype=PATH_DTYPE
+        )
+        self.parents = np.zeros(self.num_symbols, dtype=PATH_DTYPE)
+        self.parents[0] = -1
+        self.last_sym = np.arange(self.num_symbols, dtype=PATH_DTYPE)
+        self.children = dict(
+            zip(range(1, self.num_symbols), range(1, self.num_symbols))
+        )
+        self.num_paths = self.num_symbols
+        initial_path_score = log_probs[0, 1:]  # symbol probs at t=0
+
+        return BeamState.join(
             initial_paths_with_final_blank,
             initial_paths_with_final_symbols,
             initial_blank_path_score,
             initial_path_score,
         )
 
-    def prune(
-        self,
-        paths_with_terminal_blank,
-        paths_with_terminal_symbol,
-        blank_path_score,
-        path_score,
-    ):
+    def prune(self, beam):
         """
         Prune paths to keep only top 'beam_width' paths.
         """
 
-        pruned_blank_path_score = {}
-        pruned_path_score = {}
-
-        # First gather all the relevant scores
-        score_list = []
-        for path in paths_with_terminal_blank:
-            score_list.append(blank_path_score[path])
+        scores = beam.scores
 
-        for path in paths_with_terminal_symbol:
-            score_list.append(path_score[path])
+        # With alpha, first drop the paths below the threshold beam so that
+        # fewer scores reach the top-k search. The threshold is a double, capped
+        # at the best score so that the best path always survives rounding.
+        threshold = -np.inf
+        if self.alpha:
+            best = np.float64(scores.max())
+            worst = np.float64(scores.min())
+            threshold = min(self.alpha * best + (1 - self.alpha) * worst, best)
+            scores = scores[scores >= threshold]
 
-        # Sort and find cutoff score that retains exactly BeamWidth paths
-        score_list.sort(reverse=True)
+        # Find cutoff score that retains exactly BeamWidth paths; a partial
+        # partition is enough since only the BeamWidth-th largest score matters
         cutoff = (
-            score_list[self.beam_width - 1]
-            if len(score_list) >= self.beam_width
-            else score_list[-1]
+            np.partition(scores, -self.beam_width)[-self.beam_width]
+            if len(scores) > self.beam_width
+            else scores.min()
         )
+        cutoff = max(cutoff, threshold)
 
-        pruned_paths_with_terminal_blank = set()
-        for p in paths_with_terminal_blank:
-            if blank_path_score[p] >= cutoff:
-                pruned_paths_with_terminal_blank.add(p)
-                pruned_blank_path_score[p] = blank_path_score[p]
-
-        pruned_paths_with_terminal_symbol = set()
-        for p in paths_with_terminal_symbol:
-            if path_score[p] >= cutoff:
-                pruned_paths_with_terminal_symbol.add(p)
-                pruned_path_score[p] = path_score[p]
-
-        return (
-            pruned_paths_with_terminal_blank,
-            pruned_paths_with_terminal_symbol,
-            pruned_blank_path_score,
-            pruned_path_score,
-        )
+        return beam.select(beam.scores >= cutoff)
 
-    def extend_with_blank(
-        self,
-        paths_with_terminal_blank,
-        paths_with_terminal_symbol,
-        y_probs,
-    ):
-        """
-        Extend paths by a blank.
-        """
-        updated_paths_with_terminal_blank = set()
-        updated_blank_path_score = {}
-
-        # First work on paths with terminal blanks
-        for path in paths_with_terminal_blank:
-            updated_paths_with_terminal_blank.add(path)
-            updated_blank_path_score[path] = self.blank_path_score[path] * y_probs[0]
-
-        # Then extend paths with terminal symbols by blanks
-        for path in paths_with_terminal_symbol:
-            if path in updated_paths_with_terminal_blank:
-                updated_blank_path_score[path] += self.path_score[path] * y_probs[0]
-            else:
-                updated_paths_with_terminal_blank.add(path)
-                updated_blank_path_score[path] = self.path_score[path] * y_probs[0]
-        return updated_paths_with_terminal_blank, updated_blank_path_score
-
-    def extend_with_symbol(
-        self,
-        paths_with_terminal_blank,
-        paths_with_terminal_symbol,
-        y_probs,
-    ):
-        """
-        Extend paths by a symbol.
-        """
-        updated_paths_with_terminal_symbol = set()
-        updated_path_score = {}
-
-        # First extend paths with terminal blanks
-        for path in paths_with_terminal_blank:
-            for i, c in enumerate(self.symbol_set):
-                new_path = path + c
-                updated_paths_with_terminal_symbol.add(new_path)
-                updated_path_score[new_path] = (
-                    self.blank_path_score[path] * y_probs[i + 1]
+    def beam_step(self, beam, log_probs, prune=True):
+        """
+        Extend paths by a blank and by every symbol, then prune the extended
+        paths to the top 'beam_width' unless 'prune' is False. 'log_probs' holds
+        the log symbol probabilities of the current timestep.
+        """
+        if compiled_beam_step is not None:
+            beam = BeamState(
+                *compiled_beam_step(
+                    beam.paths,
+                    beam.scores,
+                    beam.is_blank,
+                    self.parents,
+                    self.last_sym,
+                    log_probs,
+                    self.num_symbols,
+                    self.beam_width,
+                    self.alpha or 0.0,
+                    prune,
+                    *self.candidate_buffers(len(beam.paths)),
                 )
+            )
+        else:
+            beam = self.extend_beam(beam, log_probs, prune)
+
+        # Only the surviving extensions are given path ids
+        is_symbol = ~beam.is_blank
+        beam.paths[is_symbol] = self.add_paths(beam.paths[is_symbol])
+
+        return beam
+
+    def extend_beam(self, beam, log_probs, prune):
+        """
+        NumPy implementation of the extension and pruning in beam_step, used
+        when neither the Cython nor the Numba kernel is available.
+        Symbol-terminal paths are returned as keys.
+        """
+        syms = np.arange(1, len(log_probs))
+        candidate_keys, candidate_scores = self.candidate_buffers(len(beam.paths))
+
+        # Extending by a blank: paths with terminal blanks and paths with terminal
+        # symbols both end in a blank now, and identical paths are merged
+        scores = candidate_scores[: len(beam.paths)]
+        np.add(beam.scores, log_probs[0], out=scores)
+        new_paths_with_terminal_blank, new_blank_path_score = self.merge_scores(
+            beam.paths, scores
+        )
+
+        # Extending paths by a symbol, every (path, symbol) pair of the beam at
+        # once in one row per path
+        keys = candidate_keys.reshape(-1, len(syms))
+        scores = candidate_scores.reshape(-1, len(syms))
+        np.multiply(beam.paths[:, None], self.num_symbols, out=keys)
+        keys += syms
+        np.add(beam.scores[:, None], log_probs[1:], out=scores)
+
+        # Repeating the last symbol of a path with a terminal symbol leaves the
+        # path (and so its key) unchanged; the repeated symbol is looked up once
+        # per path rather than compared against every symbol
+        rows = np.flatnonzero(~beam.is_blank)
+        paths_with_terminal_symbol = beam.paths[rows]
+        keys[rows, self.last_sym[paths_with_terminal_symbol] - 1] = self.path_keys(
+            paths_with_terminal_symbol
+        )
+
+        new_symbol_keys, new_path_score = self.merge_scores(
+            keys.ravel(), scores.ravel()
+        )
+
+        beam = BeamState.join(
+            new_paths_with_terminal_blank,
+            new_symbol_keys,
+            new_blank_path_score,
+            new_path_score,
+        )
+        return self.prune(beam) if prune else beam
 
-        # Then extend paths with terminal symbols
-        for path in paths_with_terminal_symbol:
-            for i, c in enumerate(self.symbol_set):
-                new_path = path if path[-1] == c else path + c
-                prob = self.path_score[path] * y_probs[i + 1]
-                if new_path in updated_paths_with_terminal_symbol:
-                    updated_path_score[new_path] += prob
-                else:
-                    updated_paths_with_terminal_symbol.add(new_path)
-                    updated_path_score[new_path] = prob
-
-        return updated_paths_with_terminal_symbol, updated_path_score
-
-    def merge_identical_paths(
-        self,
-        paths_with_terminal_blank,
-        blank_path_score,
-        paths_with_terminal_symbol,
-        path_score,
-    ):
+    def merge_identical_paths(self, beam):
         """
         Merge identical paths ending with blank and symbol.
         """
-        # All paths with terminal symbols will remain
-        merged_paths = set(paths_with_terminal_symbol)
-        final_path_scores = path_score.copy()
-
-        # Paths with terminal blanks will contribute scores to existing identical paths from
-        # PathsWithTerminalSymbol if present, or be included in the final set, otherwise
-        for p in paths_with_terminal_blank:
-            if p in merged_paths:
-                final_path_scores[p] += blank_path_score[p]
-            else:
-                merged_paths.add(p)
-                final_path_scores[p] = blank_path_score[p]
+        # A path ending in a blank and one ending in a symbol share a path id
+        # exactly when they are the same symbol sequence, so identical paths are
+        # found by sorting the ids rather than by hashing path strings
+        merged_ids, merged_scores = self.merge_scores(beam.paths, beam.scores)
+
+        # Only the surviving paths are turned back into symbol strings; the ids
+        # are unique, so the strings are too and need no set to deduplicate them
+        # The table is converted to lists once, as indexing the arrays at every
+        # hop of every walk would create a NumPy scalar each time
+        parents = self.parents[: self.num_paths].tolist()
+        last_sym = self.last_sym[: self.num_paths].tolist()
+        merged_paths = [
+            self.path_to_string(p, parents, last_sym) for p in merged_ids.tolist()
+        ]
+        final_path_scores = dict(zip(merged_paths, merged_scores))
 
         return merged_paths, final_path_scores
@@ -0,0 +1,228 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Cython build of the beam search step, used by CTCDecoding when it has been
+built and Numba is not installed. Build it in place with
+
+    cythonize -i CTC/beam_step.pyx
+
+beam_step_kernel has the same arguments and results as the NumPy/Numba
+version in CTCDecoding.py: path ids and keys are int64, scores are float32.
+"""
+
+import numpy as np
+
+from libc.math cimport INFINITY, expf, log1pf
+from libc.stdint cimport int64_t
+
+ctypedef int64_t key_t
+ctypedef float score_t
+
+
+cdef inline score_t log_add(score_t a, score_t b) noexcept nogil:
+    """
+    Return log(exp(a) + exp(b)) for scalar log scores.
+    """
+    cdef score_t tmp
+    if a < b:
+        tmp = a
+        a = b
+        b = tmp
+    if b == -INFINITY:
+        return a
+    return a + log1pf(expf(b - a))
+
+
+cdef inline Py_ssize_t push_bounded(
+    score_t[::1] heap, Py_ssize_t size, score_t score
+) noexcept nogil:
+    """
+    Push 'score' into the min-heap 'heap' holding 'size' scores, replacing its
+    minimum once it is full. Returns the new size.
+    """
+    cdef Py_ssize_t i, parent, child, smallest
+    cdef score_t tmp
+
+    if size < heap.shape[0]:
+        i = size
+        heap[i] = score
+        while i > 0 and heap[(i - 1) // 2] > heap[i]:
+            parent = (i - 1) // 2
+            tmp = heap[i]
+            heap[i] = heap[parent]
+            heap[parent] = tmp
+            i = parent
+        return size + 1
+
+    if score > heap[0]:
+        heap[0] = score
+        i = 0
+        while True:
+            smallest = i
+            child = 2 * i + 1
+            if child < size and heap[child] < heap[smallest]:
+                smallest = child
+            child += 1
+            if child < size and heap[child] < heap[smallest]:
+                smallest = child
+            if smallest == i:
+                break
+            tmp = heap[i]
+            heap[i] = heap[smallest]
+            heap[smallest] = tmp
+            i = smallest
+    return size
+
+
+cdef tuple merge_sorted(key_t[::1] keys, score_t[::1] scores):
+    """
+    Combine the log scores of repeated keys, returning the sorted unique keys
+    and their merged scores. The sort is stable, so repeated keys are merged
+    in input order as merge_scores does, and rounding agrees with it.
+    """
+    cdef Py_ssize_t[::1] order = np.argsort(keys, kind="mergesort")
+    merged_keys_array = np.empty(keys.shape[0], dtype=np.int64)
+    merged_scores_array = np.empty(keys.shape[0], dtype=np.float32)
+    cdef key_t[::1] merged_keys = merged_keys_array
+    cdef score_t[::1] merged_scores = merged_scores_array
+    cdef Py_ssize_t n = 0, j, i
+
+    with nogil:
+        for j in range(order.shape[0]):
+            i = order[j]
+            if n > 0 and merged_keys[n - 1] == keys[i]:
+                merged_scores[n - 1] = log_add(merged_scores[n - 1], scores[i])
+            else:
+                merged_keys[n] = keys[i]
+                merged_scores[n] = scores[i]
+                n += 1
+    return merged_keys_array[:n], merged_scores_array[:n]
+
+
+cdef tuple select_beam(
+    key_t[::1] blank_paths,
+    key_t[::1] symbol_keys,
+    score_t[::1] blank_scores,
+    score_t[::1] symbol_scores,
+    double cutoff,
+):
+    """
+    Return the path, score and is_blank arrays of a beam holding the merged
+    candidates that score at least 'cutoff', blank-terminal paths first.
+    """
+    cdef Py_ssize_t size = blank_paths.shape[0] + symbol_keys.shape[0]
+    paths_array = np.empty(size, dtype=np.int64)
+    scores_array = np.empty(size, dtype=np.float32)
+    is_blank_array = np.empty(size, dtype=bool)
+    cdef key_t[::1] paths = paths_array
+    cdef score_t[::1] scores = scores_array
+    cdef unsigned char[::1] is_blank = is_blank_array.view(np.uint8)
+    cdef Py_ssize_t i, n = 0
+
+    with nogil:
+        for i in range(blank_paths.shape[0]):
+            if blank_scores[i] >= cutoff:
+                paths[n] = blank_paths[i]
+                scores[n] = blank_scores[i]
+                is_blank[n] = True
+                n += 1
+        for i in range(symbol_keys.shape[0]):
+            if symbol_scores[i] >= cutoff:
+                paths[n] = symbol_keys[i]
+                scores[n] = symbol_scores[i]
+                is_blank[n] = False
+                n += 1
+    return paths_array[:n], scores_array[:n], is_blank_array[:n]
+
+
+def beam_step_kernel(
+    const key_t[:] paths,
+    const score_t[:] scores,
+    is_blank,
+    const key_t[:] parents,
+    const key_t[:] last_sym,
+    const score_t[::1] log_probs,
+    Py_ssize_t num_symbols,
+    Py_ssize_t beam_width,
+    double alpha,
+    bint prune,
+    key_t[::1] candidate_keys,
+    score_t[::1] candidate_scores,
+):
+    """
+    Extend the beam given by the arrays of a BeamState by a blank and by every
+    symbol, merge identical paths and, if 'prune', keep the top 'beam_width' of
+    those within the 'alpha' threshold beam (alpha 0 disables it). Returns the
+    arrays of the new BeamState, whose symbol-terminal paths are still
+    extension keys.
+    """
+    cdef const unsigned char[:] blank = is_blank.view(np.uint8)
+    cdef Py_ssize_t num_paths = paths.shape[0]
+    cdef Py_ssize_t num_extend = num_symbols - 1
+    cdef Py_ssize_t i, c, n, size = 0
+    cdef key_t path
+    cdef score_t best, worst
+    cdef double cutoff = -INFINITY, threshold = -INFINITY
+
+    # Extending by a blank
+    cdef key_t[::1] keys = candidate_keys[:num_paths]
+    cdef score_t[::1] new_scores = candidate_scores[:num_paths]
+    with nogil:
+        for i in range(num_paths):
+            keys[i] = paths[i]
+            new_scores[i] = scores[i] + log_probs[0]
+    new_blank_paths, new_blank_scores = merge_sorted(keys, new_scores)
+
+    # Extending by a symbol; repeating the last symbol of a symbol-terminal path
+    # keeps the path's key, so that one entry per such path is overwritten
+    # after the symbol loop
+    keys = candidate_keys[: num_paths * num_extend]
+    new_scores = candidate_scores[: keys.shape[0]]
+    with nogil:
+        n = 0
+        for i in range(num_paths):
+            for c in range(1, num_symbols):
+                keys[n] = paths[i] * num_symbols + c
+                new_scores[n] = scores[i] + log_probs[c]
+                n += 1
+            if not blank[i]:
+                path = paths[i]
+                keys[n - num_extend + last_sym[path] - 1] = (
+                    parents[path] * num_symbols + last_sym[path]
+                )
+    new_symbol_keys, new_symbol_scores = merge_sorted(keys, new_scores)
+
+    if not prune:
+        return select_beam(
+            new_blank_paths, new_symbol_keys, new_blank_scores, new_symbol_scores, cutoff
+        )
+
+    cdef score_t[::1] heap = np.empty(beam_width, dtype=np.float32)
+    cdef score_t[::1] merged_blank = new_blank_scores
+    cdef score_t[::1] merged_symbol = new_symbol_scores
+    with nogil:
+        # Scores below the alpha threshold are dropped before the top-k search.
+        # It is computed in double precision and capped at the best score, so
+        # that rounding can never leave the heap empty
+        if alpha > 0:
+            best = merged_blank[0]
+            worst = merged_blank[0]
+            for i in range(merged_blank.shape[0]):
+                best = max(best, merged_blank[i])
+                worst = min(worst, merged_blank[i])
+            for i in range(merged_symbol.shape[0]):
+                best = max(best, merged_symbol[i])
+                worst = min(worst, merged_symbol[i])
+            threshold = min(alpha * best + (1 - alpha) * worst, <double>best)
+
+        # Cutoff score retaining exactly beam_width paths from a bounded min-heap
+        for i in range(merged_blank.shape[0]):
+            if merged_blank[i] >= threshold:
+                size = push_bounded(heap, size, merged_blank[i])
+        for i in range(merged_symbol.shape[0]):
+            if merged_symbol[i] >= threshold:
+                size = push_bounded(heap, size, merged_symbol[i])
+        cutoff = max(heap[0], threshold)
+
+    return select_beam(
+        new_blank_paths, new_symbol_keys, new_blank_scores, new_symbol_scores, cutoff
+    )
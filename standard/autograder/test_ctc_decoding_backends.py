@@ -0,0 +1,180 @@
+import numpy as np
+import sys, os
+
+from test import Test
+
+sys.path.append("CTC")
+
+import CTCDecoding
+from CTCDecoding import BeamSearchDecoder
+
+EPS = 1e-20
+
+
+class BeamSearchBackendTest(Test):
+    def __init__(self):
+        # The beam step runs on the first backend that is available; each one
+        # is forced in turn by swapping the kernel that BeamSearchDecoder calls
+        self.backends = {"numpy": None, "numba": CTCDecoding.beam_step_kernel}
+        if CTCDecoding.cython_beam_step is not None:
+            self.backends["cython"] = CTCDecoding.cython_beam_step
+
+    def decode_with(self, backend, decoder, y_probs):
+        default = CTCDecoding.compiled_beam_step
+        CTCDecoding.compiled_beam_step = self.backends[backend]
+        try:
+            return decoder.decode(y_probs)
+        finally:
+            CTCDecoding.compiled_beam_step = default
+
+    def compare_backends(self, y_probs, syms, bw, alpha=None):
+        results = {
+            backend: self.decode_with(
+                backend, BeamSearchDecoder(syms, bw, alpha=alpha), y_probs
+            )
+            for backend in self.backends
+        }
+        BestPathRef, MergedPathScoresRef = results["numpy"]
+
+        for backend, (BestPath, MergedPathScores) in results.items():
+            try:
+                assert BestPath == BestPathRef
+            except Exception as e:
+                print("%s backend best path does not match NumPy" % backend)
+                print("%s best path:" % backend, BestPath)
+                print("NumPy best path:", BestPathRef)
+                return False
+
+            try:
+                assert set(MergedPathScores) == set(MergedPathScoresRef)
+                for key in MergedPathScoresRef:
+                    assert np.isclose(
+                        MergedPathScores[key], MergedPathScoresRef[key], rtol=1e-5
+                    )
+            except Exception as e:
+                print("%s backend merged paths do not match NumPy" % backend)
+                print("%s merged paths:" % backend, MergedPathScores)
+                print("NumPy merged paths:", MergedPathScoresRef)
+                return False
+        return True
+
+    def test_beam_search_backends(self):
+        ysizes = [(4, 10, 1), (6, 20, 1), (11, 30, 1)]
+        beam_widths = [2, 3, 8]
+
+        for i, (y_size, bw) in enumerate(zip(ysizes, beam_widths)):
+            np.random.seed(i)
+            y_rands = np.random.uniform(EPS, 1.0, y_size)
+            y_probs = y_rands / np.sum(y_rands, axis=0)
+            syms = [chr(ord("a") + s) for s in range(y_size[0] - 1)]
+
+            if not self.compare_backends(y_probs, syms, bw):
+                print("Failed Beam Search Backend Test: %d / %d" % (i + 1, len(ysizes)))
+                return False
+        return True
+
+    def test_beam_search_tied_scores(self):
+        # Probabilities rounded to one decimal make many paths tie, so the
+        # backends only keep the same beams if they round merges alike
+        seeds = [6, 4, 20]
+        ysizes = [(8, 17, 1), (6, 17, 1), (7, 15, 1)]
+        beam_widths = [5, 5, 4]
+
+        for i, (y_size, bw) in enumerate(zip(ysizes, beam_widths)):
+            np.random.seed(seeds[i])
+            y_rands = np.random.uniform(EPS, 1.0, y_size)
+            y_probs = np.maximum(np.round(y_rands / np.sum(y_rands, axis=0), 1), 0.01)
+            syms = [chr(ord("a") + s) for s in range(y_size[0] - 1)]
+
+            if not self.compare_backends(y_probs, syms, bw):
+                print("Failed Beam Search Tied Test: %d / %d" % (i + 1, len(ysizes)))
+                return False
+        return True
+
+    def test_beam_search_alpha_ties(self):
+        # A likely "a" at the first step leaves a beam of one path, which the
+        # even second step extends into two candidates with tied scores; the
+        # alpha threshold then lands exactly on the best score in the beam step
+        # of every backend, not only in the pruning of the initial paths
+        tied_probs = np.array([[0.2, 0.5, 0.5, 0.5], [0.8, 0.5, 0.5, 0.5]])[..., None]
+        uniform_probs = np.full((3, 4, 1), 1 / 3)
+        alphas = [i / 20 for i in range(21)]
+
+        for alpha in alphas:
+            try:
+                outcome = self.compare_backends(
+                    tied_probs, ["a"], 1, alpha=alpha
+                ) and self.compare_backends(uniform_probs, ["a", "b"], 2, alpha=alpha)
+            except Exception as e:
+                print("Beam search with alpha = %g raised %r" % (alpha, e))
+                return False
+            if not outcome:
+                print("Failed Beam Search Alpha Test: alpha = %g" % alpha)
+                return False
+
+        try:
+            BeamSearchDecoder(["a", "b"], 2, alpha=1.5)
+        except ValueError:
+            pass
+        else:
+            print("Beam search accepted alpha = 1.5")
+            return False
+        return True
+
+    def test_beam_search_alpha_prunes(self):
+        np.random.seed(0)
+        y_rands = np.random.uniform(EPS, 1.0, (6, 20, 1))
+        y_probs = y_rands / np.sum(y_rands, axis=0)
+        syms = ["a", "b", "c", "d", "e"]
+
+        for backend in self.backends:
+            _, MergedPathScores = self.decode_with(
+                backend, BeamSearchDecoder(syms, 8), y_probs
+            )
+            _, MergedPathScoresAlpha = self.decode_with(
+                backend, BeamSearchDecoder(syms, 8, alpha=1.0), y_probs
+            )
+            try:
+                assert len(MergedPathScoresAlpha) < len(MergedPathScores)
+            except Exception as e:
+                print("%s backend alpha = 1 did not prune any paths" % backend)
+                print("Merged paths without alpha:", len(MergedPathScores))
+                print("Merged paths with alpha = 1:", len(MergedPathScoresAlpha))
+                return False
+        return True
+
+    def run_test(self):
+        self.print_name("Beam Search Backends")
+        backend_outcome = self.test_beam_search_backends()
+        self.print_outcome("Beam Search Backends", backend_outcome)
+        if backend_outcome == False:
+            self.print_failure("Beam Search Backends")
+            return False
+
+        self.print_name("Beam Search Tied Scores")
+        tied_outcome = self.test_beam_search_tied_scores()
+        self.print_outcome("Beam Search Tied Scores", tied_outcome)
+        if tied_outcome == False:
+            self.print_failure("Beam Search Tied Scores")
+            return False
+
+        self.print_name("Beam Search Alpha Ties")
+        alpha_outcome = self.test_beam_search_alpha_ties()
+        self.print_outcome("Beam Search Alpha Ties", alpha_outcome)
+        if alpha_outcome == False:
+            self.print_failure("Beam Search Alpha Ties")
+            return False
+
+        self.print_name("Beam Search Alpha Pruning")
+        pruning_outcome = self.test_beam_search_alpha_prunes()
+        self.print_outcome("Beam Search Alpha Pruning", pruning_outcome)
+        if pruning_outcome == False:
+            self.print_failure("Beam Search Alpha Pruning")
+            return False
+
+        return True
+
+
+if __name__ == "__main__":
+    if not BeamSearchBackendTest().run_test():
+        sys.exit(1)
@@ -0,0 +1,98 @@
+import numpy as np
+import sys, os
+
+from test import Test
+
+sys.path.append("CTC")
+
+from CTCDecoding import GreedySearchDecoder, BeamSearchDecoder
+
+EPS = 1e-20
+
+
+class BatchSearchTest(Test):
+    def __init__(self):
+        pass
+
+    def batch_probs(self, SEED, y_size):
+        np.random.seed(SEED)
+        y_rands = np.random.uniform(EPS, 1.0, y_size)
+        return y_rands / np.sum(y_rands, axis=0)
+
+    def test_greedy_search_batch(self):
+        y_probs = self.batch_probs(11785, (4, 10, 3))
+        SymbolSets = ["a", "b", "c"]
+
+        decoder = GreedySearchDecoder(SymbolSets)
+        best_paths, scores = decoder.decode(y_probs)
+        log_probs = decoder.log_prob
+
+        for b in range(y_probs.shape[2]):
+            best_path, score = decoder.decode(y_probs[:, :, b : b + 1])
+
+            try:
+                assert best_paths[b] == best_path
+                assert scores[b] == score
+            except Exception as e:
+                print("Greedy search of sequence %d in the batch does not match" % b)
+                print("Batch result:   ", best_paths[b], scores[b])
+                print("Sequence result:", best_path, score)
+                return False
+
+            try:
+                assert np.isclose(log_probs[b], decoder.log_prob)
+                assert np.isclose(decoder.log_prob, np.log(score))
+            except Exception as e:
+                print("Greedy search log_prob of sequence %d does not match" % b)
+                print("Batch log_prob:   ", log_probs[b])
+                print("Sequence log_prob:", decoder.log_prob)
+                print("Log of score:     ", np.log(score))
+                return False
+        return True
+
+    def test_beam_search_batch(self):
+        y_probs = self.batch_probs(0, (5, 20, 3))
+        SymbolSets = ["a", "b", "c", "d"]
+        BeamWidth = 3
+
+        decoder = BeamSearchDecoder(SymbolSets, BeamWidth)
+        BestPaths, MergedPathScores = decoder.decode(y_probs)
+
+        for b in range(y_probs.shape[2]):
+            BestPath, MergedPathScoresRef = decoder.decode(y_probs[:, :, b : b + 1])
+
+            try:
+                assert BestPaths[b] == BestPath
+                assert set(MergedPathScores[b]) == set(MergedPathScoresRef)
+                for key in MergedPathScoresRef:
+                    assert np.isclose(
+                        MergedPathScores[b][key], MergedPathScoresRef[key]
+                    )
+            except Exception as e:
+                print("Beam search of sequence %d in the batch does not match" % b)
+                print("Batch result:   ", BestPaths[b], MergedPathScores[b])
+                print("Sequence result:", BestPath, MergedPathScoresRef)
+                return False
+        return True
+
+    def run_test(self):
+        self.print_name("Greedy Search Batch")
+        greedy_outcome = self.test_greedy_search_batch()
+        self.print_outcome("Greedy Search Batch", greedy_outcome)
+        if greedy_outcome == False:
+            self.print_failure("Greedy Search Batch")
+            return False
+
+        self.print_name("Beam Search Batch")
+        beam_outcome = self.test_beam_search_batch()
+        self.print_outcome("Beam Search Batch", beam_outcome)
+        if beam_outcome == False:
+            self.print_failure("Beam Search Batch")
+            return False
+
+        return True
+
+
+if __name__ == "__main__":
+    if not BatchSearchTest().run_test():
+        sys.exit(1)